@@ -7,12 +7,14 @@ Generates synthetic test data for e-commerce product catalog cleaning scenarios.
 import duckdb
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+import pyarrow as pa
+from datetime import datetime
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import sys
-from typing import Dict
+from typing import Dict, Iterable, Iterator, List, Set, Tuple, Union
 
 # Project directory structure
 PROJECT_ROOT = Path('~/freelance').expanduser()
@@ -23,6 +25,28 @@ SYNTHETIC_DATA_DIR = TESTING_DIR / 'synthetic-data'
 TEST_RESULTS_DIR = TESTING_DIR / 'test-results'
 SCENARIOS_DIR = TESTING_DIR / 'scenarios'
 
+# Quality check definitions: (check_id, check_name, check_type, severity, pass_threshold)
+QUALITY_CHECKS = [
+    (1, 'SKU Format Check', 'format', 'high', 0.98),
+    (2, 'Price Range Check', 'range', 'high', 0.95),
+    (3, 'Category Consistency', 'consistency', 'medium', 0.90),
+    (4, 'Inventory Validation', 'range', 'high', 0.99),
+    (5, 'Duplicate Detection', 'uniqueness', 'high', 0.98),
+    (6, 'Missing Value Check', 'completeness', 'medium', 0.93),
+]
+
+# Arrow schema of generated product data, fixed so every streamed batch matches
+PRODUCT_SCHEMA = pa.schema([
+    ('sku', pa.string()),
+    ('product_name', pa.string()),
+    ('category', pa.string()),
+    ('subcategory', pa.string()),
+    ('price', pa.float64()),
+    ('price_malformed', pa.bool_()),
+    ('inventory', pa.int64()),
+    ('last_updated', pa.timestamp('ns')),
+])
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -37,6 +61,9 @@ logger = logging.getLogger(__name__)
 class TestDataGenerator:
     """Generates synthetic e-commerce test data with controlled quality issues."""
     
+    # Directories already created in this process, shared across instances
+    _created_dirs: Set[Path] = set()
+    
     def __init__(self, scenario_name: str = 'ecommerce'):
         self.scenario_name = scenario_name
         self.scenario_dir = SYNTHETIC_DATA_DIR / scenario_name
@@ -53,6 +80,18 @@ class TestDataGenerator:
             'Toys': ['Educational', 'Games', 'Outdoor', 'Arts & Crafts', 'Building']
         }
         
+        # Flattened subcategory lookup: per-category offset and length into one array
+        self._sub_flat = np.array([sub for category in self.categories for sub in self.subcategories[category]])
+        self._sub_len = np.array([len(self.subcategories[category]) for category in self.categories])
+        self._sub_off = np.concatenate(([0], np.cumsum(self._sub_len)[:-1]))
+        
+        # Category names and SKU prefixes cached for indexing by category/subcategory position
+        self._category_names = np.array(self.categories)
+        self._category_names_lower = np.char.lower(self._category_names)
+        sub_pairs = list(zip(np.repeat(self.categories, self._sub_len), self._sub_flat))
+        self._sku_prefix = np.array([f"{c[:2].upper()}-{s[:2].upper()}-" for c, s in sub_pairs])
+        self._sku_prefix_malformed = np.array([f"{c[:2]}-{s[:2]}-" for c, s in sub_pairs])
+        
         # Ensure directories exist
         self._setup_directories()
 
@@ -60,70 +99,113 @@ class TestDataGenerator:
         """Create necessary directories if they don't exist."""
         try:
             for dir_path in [SYNTHETIC_DATA_DIR, TEST_RESULTS_DIR, SCENARIOS_DIR, self.scenario_dir]:
-                dir_path.mkdir(parents=True, exist_ok=True)
+                if dir_path not in self._created_dirs:
+                    dir_path.mkdir(parents=True, exist_ok=True)
+                    self._created_dirs.add(dir_path)
         except Exception as e:
             self.logger.error(f"Failed to create directories: {e}")
             raise
 
-    def generate_sku(self, category: str, subcategory: str, force_error: bool = False) -> str:
-        """Generate a SKU with optional formatting issues."""
-        if force_error or np.random.random() < 0.1:  # 10% chance of malformed SKU
-            return f"{category[:2]}-{subcategory[:2]}-{np.random.randint(1000, 9999)}"
-        return f"{category[:2].upper()}-{subcategory[:2].upper()}-{np.random.randint(1000, 9999)}"
+    def generate_sku(self, rng: np.random.Generator, sub_idx: np.ndarray, numbers: np.ndarray,
+                     force_error: bool = False) -> np.ndarray:
+        """Generate SKUs for flattened subcategory indices with optional formatting issues."""
+        malformed = force_error | (rng.random(len(numbers)) < 0.1)  # 10% chance of malformed SKU
+        prefix = np.where(malformed, self._sku_prefix_malformed[sub_idx], self._sku_prefix[sub_idx])
+        return np.char.add(prefix, numbers.astype(str))
 
-    def generate_price(self, force_error: bool = False) -> float:
-        """Generate a price value with optional formatting issues."""
-        base_price = np.random.uniform(10, 500)
-        if force_error or np.random.random() < 0.05:  # 5% chance of price formatting issue
-            return f"${base_price:.2f}"  # String instead of numeric
-        return base_price
+    def generate_price(self, rng: np.random.Generator, num_records: int,
+                       force_error: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Generate price values and flags marking prices to export with formatting issues."""
+        prices = rng.uniform(10, 500, num_records)
+        malformed = force_error | (rng.random(num_records) < 0.05)  # 5% chance of price formatting issue
+        return prices, malformed
 
-    def generate_inventory(self, force_error: bool = False) -> int:
-        """Generate inventory value with optional invalid values."""
-        if force_error or np.random.random() < 0.08:  # 8% chance of invalid inventory
-            return -np.random.randint(1, 10)  # Negative inventory
-        return np.random.randint(0, 100)
+    def generate_inventory(self, rng: np.random.Generator, base_inventories: np.ndarray,
+                           force_error: bool = False) -> np.ndarray:
+        """Generate inventory values with optional invalid values."""
+        invalid = force_error | (rng.random(len(base_inventories)) < 0.08)  # 8% chance of invalid inventory
+        negative = -rng.integers(1, 10, size=len(base_inventories))  # Negative inventory
+        return np.where(invalid, negative, base_inventories)
 
-    def generate_product_data(self, num_records: int = 10000) -> pd.DataFrame:
-        """Generate synthetic product catalog data with controlled quality issues."""
-        self.logger.info(f"Generating {num_records} product records...")
+    def _generate_batch(self, rng: np.random.Generator, start: int, num_records: int) -> pd.DataFrame:
+        """Generate one batch of product records, numbered from start, with controlled quality issues."""
+        # Draw each column as one batch instead of sampling row by row
+        cat_idx = rng.integers(0, len(self.categories), size=num_records)
+        
+        sub_idx = self._sub_off[cat_idx] + (rng.random(num_records) * self._sub_len[cat_idx]).astype(int)
+        subcategories = self._sub_flat[sub_idx]
+        
+        prices, price_malformed = self.generate_price(rng, num_records)
+        inventories = rng.integers(0, 100, num_records)
+        sku_nums = rng.integers(1000, 9999, num_records)
+        days_back = rng.integers(0, 365, num_records).astype('timedelta64[D]')
+        last_updated = (np.datetime64(datetime.now(), 'us') - days_back).astype('datetime64[ns]')
+        
+        # Product name suffixes and lowercase categories (15%) for consistency issues
+        suffixes = np.array(['', ' (New)', ' - Latest Model', ' [Updated]'])
+        name_suffix = suffixes[rng.integers(0, len(suffixes), num_records)]
+        lower_category = rng.random(num_records) < 0.15
+        
+        df = pd.DataFrame({
+            'sku': self.generate_sku(rng, sub_idx, sku_nums),
+            'product_name': (
+                'Test Product ' + pd.Series(np.arange(start, start + num_records).astype(str)) + pd.Series(name_suffix)
+            ),
+            'category': np.where(lower_category, self._category_names_lower[cat_idx], self._category_names[cat_idx]),
+            'subcategory': subcategories,
+            'price': prices,
+            'price_malformed': price_malformed,
+            'inventory': self.generate_inventory(rng, inventories),
+            'last_updated': last_updated
+        })
         
-        np.random.seed(42)  # For reproducibility
-        data = []
+        # Add duplicate records with variations (5% of records)
+        num_duplicates = int(num_records * 0.05)
+        dup = df.sample(n=num_duplicates, replace=True, random_state=rng).reset_index(drop=True)
+        dup['product_name'] = dup['product_name'].str.rstrip() + ' '
+        dup['price'] = dup['price'] * 1.01
+        df = pd.concat([df, dup], ignore_index=True)
+        
+        # Add missing values (7% of cells) column by column so numeric and
+        # datetime columns keep their dtypes; inventory uses nullable Int64
+        df['inventory'] = df['inventory'].astype('Int64')
+        for col in df.columns.drop('price_malformed'):
+            df[col] = df[col].mask(rng.random(len(df)) < 0.07)
+        
+        return df
+
+    def _iter_frames(self, num_records: int, batch_size: int) -> Iterator[pd.DataFrame]:
+        """Yield product data batch by batch, each batch seeded from its own child SeedSequence."""
+        starts = range(0, num_records, batch_size)
+        # For reproducibility; generation draws from the (0,) subtree of the seed,
+        # export row selections from (1,), so the two streams never overlap
+        seeds = np.random.SeedSequence(42, spawn_key=(0,)).spawn(len(starts))
+        for start, seed in zip(starts, seeds):
+            yield self._generate_batch(np.random.default_rng(seed), start, min(batch_size, num_records - start))
+
+    def iter_batches(self, num_records: int = 10000, batch_size: int = 65536) -> Iterator[pa.RecordBatch]:
+        """Stream synthetic product data as Arrow record batches to keep memory flat as num_records grows."""
+        self.logger.info(f"Streaming {num_records} product records in batches of {batch_size}...")
         
         try:
-            for i in range(num_records):
-                category = np.random.choice(self.categories)
-                subcategory = np.random.choice(self.subcategories[category])
+            for df in self._iter_frames(num_records, batch_size):
+                yield from pa.Table.from_pandas(df, schema=PRODUCT_SCHEMA, preserve_index=False).to_batches()
                 
-                record = {
-                    'sku': self.generate_sku(category, subcategory),
-                    'product_name': f"Test Product {i}{np.random.choice(['', ' (New)', ' - Latest Model', ' [Updated]'])}",
-                    'category': category.lower() if np.random.random() < 0.15 else category,
-                    'subcategory': subcategory,
-                    'price': self.generate_price(),
-                    'inventory': self.generate_inventory(),
-                    'last_updated': datetime.now() - timedelta(days=np.random.randint(0, 365))
-                }
-                data.append(record)
-            
-            # Add duplicate records with variations (5% of records)
-            num_duplicates = int(num_records * 0.05)
-            for _ in range(num_duplicates):
-                original = data[np.random.randint(0, len(data))].copy()
-                original['product_name'] = original['product_name'].strip() + ' '
-                if isinstance(original['price'], str):
-                    price_val = float(original['price'].replace('$', ''))
-                    original['price'] = f"${price_val * 1.01:.2f}"
-                else:
-                    original['price'] = original['price'] * 1.01
-                data.append(original)
-            
-            df = pd.DataFrame(data)
-            
-            # Add missing values (7% of cells)
-            mask = np.random.random(df.shape) < 0.07
-            df[mask] = None
+        except Exception as e:
+            self.logger.error(f"Error generating product data: {e}")
+            raise
+
+    def generate_product_data(self, num_records: int = 10000, batch_size: int = 65536) -> pd.DataFrame:
+        """Generate synthetic product catalog data with controlled quality issues."""
+        self.logger.info(f"Generating {num_records} product records...")
+        
+        try:
+            frames = list(self._iter_frames(num_records, batch_size))
+            if frames:
+                df = pd.concat(frames, ignore_index=True)
+            else:
+                # No batches for num_records <= 0; keep the same columns and dtypes
+                df = PRODUCT_SCHEMA.empty_table().to_pandas().astype({'inventory': 'Int64'})
             
             self.logger.info(f"Generated {len(df)} records including duplicates")
             return df
@@ -132,62 +214,80 @@ class TestDataGenerator:
             self.logger.error(f"Error generating product data: {e}")
             raise
 
-    def save_test_files(self, df: pd.DataFrame) -> Dict[str, Path]:
-        """Save test data in multiple file formats."""
+    def save_test_files(self, data: Union[pd.DataFrame, Iterable[pa.RecordBatch]]) -> Dict[str, Path]:
+        """Save test data, given as a DataFrame or a stream of record batches, in multiple file formats."""
         self.logger.info("Saving test files in multiple formats...")
         
         file_paths = {}
         try:
             # Set up DuckDB connection for file creation
             conn = duckdb.connect(':memory:')
-            conn.execute("INSTALL spatial;")
-            conn.execute("LOAD spatial;")
+            conn.execute("INSTALL excel;")
+            conn.execute("LOAD excel;")
+            
+            if isinstance(data, pd.DataFrame):
+                data = pa.Table.from_pandas(data, schema=PRODUCT_SCHEMA, preserve_index=False).to_batches()
+            
+            # Stream all data into DuckDB through Arrow in a single pass; a reader can
+            # only be consumed once, so it is materialized for the exports below
+            split_rng = np.random.default_rng(np.random.SeedSequence(42, spawn_key=(1,)))
+            conn.register('all_data_stream', self._with_export_splits(data, split_rng))
+            conn.execute("CREATE TABLE all_data AS SELECT * FROM all_data_stream")
+            conn.unregister('all_data_stream')
             
-            # Create temporary table with all data
-            conn.execute("CREATE TABLE all_data AS SELECT * FROM df")
+            copies: List[str] = []
+            
+            # Prices stay numeric in memory; malformed ones get a currency symbol on export
+            price_text = "CASE WHEN price_malformed THEN '$' || printf('%.2f', price) ELSE price::VARCHAR END"
             
             # Main catalog in CSV
             main_catalog = self.scenario_dir / 'main_catalog.csv'
-            conn.execute(f"""
+            copies.append(f"""
                 COPY (
-                    SELECT * FROM all_data 
-                    WHERE random() <= 0.6
+                    SELECT sku, product_name, category, subcategory,
+                           {price_text} AS price, inventory, last_updated
+                    FROM all_data 
+                    WHERE in_main_catalog
                 ) TO '{main_catalog}' (HEADER true)
             """)
             file_paths['main_catalog'] = main_catalog
             
-            # Inventory update in Excel using spatial extension
+            # Inventory update in Excel using the excel extension
             inventory_update = self.scenario_dir / 'inventory_update.xlsx'
-            conn.execute(f"""
+            copies.append(f"""
                 COPY (
                     SELECT sku, inventory, last_updated 
                     FROM all_data 
-                    WHERE random() <= 0.3
-                ) TO '{inventory_update}' (FORMAT GDAL, DRIVER 'xlsx')
+                    WHERE in_inventory_update
+                ) TO '{inventory_update}' (FORMAT XLSX, HEADER true)
             """)
             file_paths['inventory'] = inventory_update
             
             # Price list in JSON
             price_list = self.scenario_dir / 'price_list.json'
-            conn.execute(f"""
+            copies.append(f"""
                 COPY (
-                    SELECT sku, price 
+                    SELECT sku, {price_text} AS price
                     FROM all_data 
-                    WHERE random() <= 0.4
-                ) TO '{price_list}' (FORMAT JSON)
+                    WHERE in_price_list
+                ) TO '{price_list}' (FORMAT JSON, ARRAY true)
             """)
             file_paths['prices'] = price_list
             
             # Category mapping in Parquet
             category_mapping = self.scenario_dir / 'category_mapping.parquet'
-            conn.execute(f"""
+            copies.append(f"""
                 COPY (
                     SELECT DISTINCT sku, category, subcategory 
                     FROM all_data
-                ) TO '{category_mapping}' (FORMAT PARQUET)
+                ) TO '{category_mapping}' (FORMAT PARQUET, COMPRESSION ZSTD)
             """)
             file_paths['categories'] = category_mapping
             
+            # Run the exports concurrently, one cursor per thread
+            with ThreadPoolExecutor(max_workers=len(copies)) as executor:
+                list(executor.map(lambda sql: self._run_copy(conn, sql), copies))
+            
             conn.close()
             self.logger.info(f"Successfully saved test files to {self.scenario_dir}")
             return file_paths
@@ -196,6 +296,31 @@ class TestDataGenerator:
             self.logger.error(f"Error saving test files: {e}")
             raise
 
+    def _with_export_splits(self, batches: Iterable[pa.RecordBatch],
+                            rng: np.random.Generator) -> pa.RecordBatchReader:
+        """Wrap record batches in a reader that adds each export's row selection as boolean columns."""
+        schema = PRODUCT_SCHEMA
+        for name in ['in_main_catalog', 'in_inventory_update', 'in_price_list']:
+            schema = schema.append(pa.field(name, pa.bool_()))
+        
+        def tagged() -> Iterator[pa.RecordBatch]:
+            for batch in batches:
+                # Draw each file's row selection (60% / 30% / 40%) in NumPy so the
+                # exports filter on flags instead of calling random() per scan
+                splits = rng.random((batch.num_rows, 3)) < np.array([0.6, 0.3, 0.4])
+                flags = [pa.array(splits[:, i]) for i in range(3)]
+                yield pa.RecordBatch.from_arrays(batch.columns + flags, schema=schema)
+        
+        return pa.RecordBatchReader.from_batches(schema, tagged())
+
+    def _run_copy(self, conn: duckdb.DuckDBPyConnection, sql: str) -> None:
+        """Execute a COPY statement on its own cursor."""
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql)
+        finally:
+            cursor.close()
+
     def setup_duckdb(self) -> duckdb.DuckDBPyConnection:
         """Initialize DuckDB database with test data and quality metrics framework."""
         self.logger.info("Setting up DuckDB environment...")
@@ -204,10 +329,6 @@ class TestDataGenerator:
             db_path = TEST_RESULTS_DIR / f'{self.scenario_name}.db'
             conn = duckdb.connect(str(db_path))
             
-            # Install required extensions
-            conn.execute("INSTALL spatial;")
-            conn.execute("LOAD spatial;")
-            
             # Create quality metrics tables
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS quality_metrics (
@@ -227,16 +348,8 @@ class TestDataGenerator:
                 );
             """)
             
-            # Insert quality check definitions
-            conn.execute("""
-                INSERT INTO quality_metrics VALUES
-                    (1, 'SKU Format Check', 'format', 'high', 0.98),
-                    (2, 'Price Range Check', 'range', 'high', 0.95),
-                    (3, 'Category Consistency', 'consistency', 'medium', 0.90),
-                    (4, 'Inventory Validation', 'range', 'high', 0.99),
-                    (5, 'Duplicate Detection', 'uniqueness', 'high', 0.98),
-                    (6, 'Missing Value Check', 'completeness', 'medium', 0.93);
-            """)
+            # Insert quality check definitions through one prepared statement
+            conn.executemany("INSERT INTO quality_metrics VALUES (?, ?, ?, ?, ?)", QUALITY_CHECKS)
             
             self.logger.info(f"DuckDB environment set up at {db_path}")
             return conn
@@ -289,11 +402,8 @@ def main():
         # Initialize generator
         generator = TestDataGenerator()
         
-        # Generate test data
-        df = generator.generate_product_data()
-        
-        # Save test files in multiple formats
-        file_paths = generator.save_test_files(df)
+        # Generate test data and stream it into the test files in multiple formats
+        file_paths = generator.save_test_files(generator.iter_batches())
         
         # Set up DuckDB environment
         conn = generator.setup_duckdb()